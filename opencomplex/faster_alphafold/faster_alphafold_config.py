@@ -8,10 +8,12 @@ faster_alphafold_config = mlc.ConfigDict({
     'attention': True,
     'outer_product_mean': True,
     'triangle_multiplicative_update': True,
+    'compile_confidence_metrics': False,
 }) if torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8 else mlc.ConfigDict({
     'layer_norm': False,
     'softmax': False,
     'attention': False,
     'outer_product_mean': False,
     'triangle_multiplicative_update': False,
+    'compile_confidence_metrics': False,
 })
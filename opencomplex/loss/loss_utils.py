@@ -14,10 +14,66 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from functools import lru_cache, wraps
 from typing import Optional, Tuple, Dict
 import torch
 
-from opencomplex.utils.tensor_utils import permute_final_dims
+from opencomplex.faster_alphafold.faster_alphafold_config import faster_alphafold_config
+
+_LDDT_THRESHOLDS = (0.5, 1.0, 2.0, 4.0)
+
+
+def _maybe_compile(fn):
+    # The confidence metrics are chains of small pointwise ops and
+    # reductions, which Inductor can fuse into a few kernels. Compilation is
+    # opt-in via faster_alphafold_config.compile_confidence_metrics, checked
+    # on every call, and happens lazily on the first compiled call
+    compiled_fn = None
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        nonlocal compiled_fn
+        if not faster_alphafold_config.compile_confidence_metrics:
+            return fn(*args, **kwargs)
+        if compiled_fn is None:
+            if not hasattr(torch, "compile"):
+                raise ValueError(
+                    "compile_confidence_metrics requires PyTorch >= 2.0"
+                )
+            compiled_fn = torch.compile(fn, dynamic=True)
+        return compiled_fn(*args, **kwargs)
+
+    return wrapper
+
+
+# The helpers below build small constant tensors that only depend on their
+# (hashable) arguments. Caching them saves an allocation and a kernel launch
+# on every call. Only tensors whose size does not grow with the input may be
+# cached here, since every entry stays alive for the life of the process.
+# Callers must not modify the returned tensors in place.
+@lru_cache(maxsize=16)
+def _cached_boundaries(no_bins: int, max_bin: int, device: torch.device):
+    return torch.linspace(0, max_bin, steps=(no_bins - 1), device=device)
+
+
+@lru_cache(maxsize=16)
+def _cached_bin_centers(no_bins: int, max_bin: int, device: torch.device):
+    return _calculate_bin_centers(
+        _cached_boundaries(no_bins, max_bin, device)
+    )
+
+
+@lru_cache(maxsize=16)
+def _cached_plddt_bounds(no_bins: int, device: torch.device):
+    bin_width = 1.0 / no_bins
+    return torch.arange(
+        start=0.5 * bin_width, end=1.0, step=bin_width, device=device
+    )
+
+
+@lru_cache(maxsize=16)
+def _cached_lddt_thresholds(device: torch.device, dtype: torch.dtype):
+    return torch.tensor(_LDDT_THRESHOLDS, device=device, dtype=dtype)
 
 def softmax_cross_entropy(logits, labels):
     loss = -1 * torch.sum(
@@ -27,18 +83,25 @@ def softmax_cross_entropy(logits, labels):
     return loss
 
 def sigmoid_cross_entropy(logits, labels):
-    logits_dtype = logits.dtype
-    logits = logits.double()
-    labels = labels.double()
-    log_p = torch.nn.functional.logsigmoid(logits)
-    # log_p = torch.log(torch.sigmoid(logits))
-    log_not_p = torch.nn.functional.logsigmoid(-1 * logits)
-    # log_not_p = torch.log(torch.sigmoid(-logits))
-    loss = (-1. * labels) * log_p - (1. - labels) * log_not_p
-    loss = loss.to(dtype=logits_dtype)
+    # binary_cross_entropy_with_logits uses the numerically stable
+    # max(x, 0) - x * z + log(1 + exp(-|x|)) form, so fp32 is sufficient
+    loss = torch.nn.functional.binary_cross_entropy_with_logits(
+        logits.float(), labels.float(), reduction="none"
+    )
+    loss = loss.to(dtype=logits.dtype)
     return loss
 
 
+def _pairwise_distances(x: torch.Tensor) -> torch.Tensor:
+    # The matmul-based euclidean path cancels badly for large coordinates,
+    # so distances are computed from direct differences. That kernel only
+    # supports fp32/fp64, so half-precision positions are upcast
+    dtype = x.dtype
+    x = x.to(dtype=torch.promote_types(dtype, torch.float32)).contiguous()
+    d = torch.cdist(x, x, compute_mode="donot_use_mm_for_euclid_dist")
+    return d.to(dtype=dtype)
+
+
 def lddt(
     all_atom_pred_pos: torch.Tensor,
     all_atom_positions: torch.Tensor,
@@ -48,45 +111,27 @@ def lddt(
     per_residue: bool = True,
 ) -> torch.Tensor:
     n = all_atom_mask.shape[-2]
-    dmat_true = torch.sqrt(
-        eps
-        + torch.sum(
-            (
-                all_atom_positions[..., None, :]
-                - all_atom_positions[..., None, :, :]
-            )
-            ** 2,
-            dim=-1,
-        )
-    )
+    # cdist avoids materializing the [*, N, N, 3] difference tensors. The
+    # scores are only used as (detached) targets and metrics, so the eps
+    # that stabilized the sqrt gradient at zero distance is not needed
+    dmat_true = _pairwise_distances(all_atom_positions)
+    dmat_pred = _pairwise_distances(all_atom_pred_pos)
 
-    dmat_pred = torch.sqrt(
-        eps
-        + torch.sum(
-            (
-                all_atom_pred_pos[..., None, :]
-                - all_atom_pred_pos[..., None, :, :]
-            )
-            ** 2,
-            dim=-1,
-        )
-    )
     dists_to_score = (
         (dmat_true < cutoff)
         * all_atom_mask
-        * permute_final_dims(all_atom_mask, (1, 0))
+        * all_atom_mask.transpose(-1, -2)
         * (1.0 - torch.eye(n, device=all_atom_mask.device))
     )
 
     dist_l1 = torch.abs(dmat_true - dmat_pred)
 
-    score = (
-        (dist_l1 < 0.5).type(dist_l1.dtype)
-        + (dist_l1 < 1.0).type(dist_l1.dtype)
-        + (dist_l1 < 2.0).type(dist_l1.dtype)
-        + (dist_l1 < 4.0).type(dist_l1.dtype)
+    # Number of thresholds each distance error falls below, in one pass
+    thresholds = _cached_lddt_thresholds(dist_l1.device, dist_l1.dtype)
+    score = len(_LDDT_THRESHOLDS) - torch.bucketize(
+        dist_l1, thresholds, right=True
     )
-    score = score * 0.25
+    score = score.type(dist_l1.dtype) * 0.25
 
     dims = (-1,) if per_residue else (-2, -1)
     norm = 1.0 / (eps + torch.sum(dists_to_score, dim=dims))
@@ -106,17 +151,28 @@ def compute_tm(
     if residue_weights is None:
         residue_weights = logits.new_ones(logits.shape[-2])
 
-    boundaries = torch.linspace(
-        0, max_bin, steps=(no_bins - 1), device=logits.device
-    )
-
-    bin_centers = _calculate_bin_centers(boundaries)
-    torch.sum(residue_weights)
+    bin_centers = _cached_bin_centers(no_bins, max_bin, logits.device)
     n = logits.shape[-2]
     clipped_n = max(n, 19)
 
     d0 = 1.24 * (clipped_n - 15) ** (1.0 / 3) - 1.8
 
+    return _compute_tm(
+        logits, residue_weights, bin_centers, d0, eps=eps, asym_id=asym_id
+    )
+
+
+# Constants are resolved by the caller so that the compiled region does not
+# trace through the lru_cache helpers
+@_maybe_compile
+def _compute_tm(
+    logits: torch.Tensor,
+    residue_weights: torch.Tensor,
+    bin_centers: torch.Tensor,
+    d0: float,
+    eps: float = 1e-8,
+    asym_id: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
     probs = torch.nn.functional.softmax(logits, dim=-1)
 
     tm_per_bin = 1.0 / (1 + (bin_centers ** 2) / (d0 ** 2))
@@ -128,15 +184,18 @@ def compute_tm(
 
     predicted_tm_term *= pair_mask
 
-    pair_residue_weights = pair_mask * (
-        residue_weights[None, :] * residue_weights[:, None])
+    pair_residue_weights = pair_mask * torch.outer(
+        residue_weights, residue_weights
+    )
     normed_residue_mask = pair_residue_weights / (eps + pair_residue_weights.sum())
     per_alignment = torch.sum(predicted_tm_term * normed_residue_mask, dim=-1)
 
     weighted = per_alignment * residue_weights
-     
-    argmax = (weighted == torch.max(weighted)).nonzero()[0]
-    return per_alignment[tuple(argmax)]
+
+    # argmax over the flattened tensor picks the first maximum, as before,
+    # without the host sync of nonzero()
+    argmax = torch.argmax(weighted)
+    return per_alignment.reshape(-1)[argmax]
 
 
 def _calculate_bin_centers(boundaries: torch.Tensor):
@@ -148,6 +207,7 @@ def _calculate_bin_centers(boundaries: torch.Tensor):
     return bin_centers
 
 
+@_maybe_compile
 def _calculate_expected_aligned_error(
     alignment_confidence_breaks: torch.Tensor,
     aligned_distance_error_probs: torch.Tensor,
@@ -179,9 +239,7 @@ def compute_predicted_aligned_error(
         error for each pair of residues.
       max_predicted_aligned_error: [*] the maximum predicted error possible.
     """
-    boundaries = torch.linspace(
-        0, max_bin, steps=(no_bins - 1), device=logits.device
-    )
+    boundaries = _cached_boundaries(no_bins, max_bin, logits.device)
 
     aligned_confidence_probs = torch.nn.functional.softmax(logits, dim=-1)
     (
@@ -207,10 +265,12 @@ def lddt_all(
     eps: float = 1e-10,
     per_residue: bool = True,
 ) -> torch.Tensor:
-    nn=int(all_atom_pred_pos.shape[0])*int(all_atom_pred_pos.shape[1])
-    all_atom_pred_pos = all_atom_pred_pos.reshape(nn,3)
-    all_atom_positions = all_atom_positions.reshape(nn,3)
-    all_atom_mask = all_atom_mask.reshape(nn,1)  # keep dim
+    # [N_res, N_atom, 3] -> [N_res * N_atom, 3]. The leading dims are
+    # residues and atoms rather than a batch, so every atom is scored against
+    # every other atom. reshape only copies non-contiguous inputs
+    all_atom_pred_pos = all_atom_pred_pos.reshape(-1, 3)
+    all_atom_positions = all_atom_positions.reshape(-1, 3)
+    all_atom_mask = all_atom_mask.reshape(-1, 1)  # keep dim
     return lddt(
         all_atom_pred_pos,
         all_atom_positions,
@@ -244,10 +304,12 @@ def lddt_ca(
 
 def compute_plddt(logits: torch.Tensor) -> torch.Tensor:
     num_bins = logits.shape[-1]
-    bin_width = 1.0 / num_bins
-    bounds = torch.arange(
-        start=0.5 * bin_width, end=1.0, step=bin_width, device=logits.device
-    )
+    bounds = _cached_plddt_bounds(num_bins, logits.device)
+    return _compute_plddt(logits, bounds)
+
+
+@_maybe_compile
+def _compute_plddt(logits: torch.Tensor, bounds: torch.Tensor) -> torch.Tensor:
     probs = torch.nn.functional.softmax(logits, dim=-1)
     pred_lddt_ca = torch.sum(
         probs * bounds.view(*((1,) * len(probs.shape[:-1])), *bounds.shape),
@@ -15,7 +15,7 @@
 # limitations under the License.
 
 from functools import partial
-from typing import Optional
+from typing import Optional, Union
 
 import torch
 import torch.nn as nn
@@ -53,14 +53,28 @@ class OuterProductMean(nn.Module):
             linear_2 = Linear(c_m, c_hidden)
             self.linear_12 = Linear(c_m, c_hidden * 2)
             self.linear_12.weight.data.copy_(torch.cat((linear_1.weight.data, linear_2.weight.data), 0))
+            self.linear_12.bias.data.copy_(torch.cat((linear_1.bias.data, linear_2.bias.data), 0))
         else:
             self.linear_1 = Linear(c_m, c_hidden)
             self.linear_2 = Linear(c_m, c_hidden)
         self.linear_out = Linear(c_hidden ** 2, c_z, init="final")
 
-    def _opm(self, a, b):
+    def _opm(self, a, b, norm, inplace_safe=False):
+        # [*, N_res * C, N_seq]
+        a2 = a.transpose(-1, -2).reshape(a.shape[:-3] + (-1, a.shape[-2]))
+
+        # [*, N_seq, N_res * C]
+        b2 = b.transpose(-2, -3).reshape(b.shape[:-3] + (b.shape[-2], -1))
+
+        # A single GEMM over the sequence dimension
+        # [*, N_res * C, N_res * C]
+        outer = torch.matmul(a2, b2)
+
         # [*, N_res, N_res, C, C]
-        outer = torch.einsum("...bac,...dae->...bdce", a, b)
+        outer = outer.view(
+            outer.shape[:-2] +
+            (a.shape[-3], a.shape[-1], b.shape[-3], b.shape[-1])
+        ).transpose(-2, -3)
 
         # [*, N_res, N_res, C * C]
         outer = outer.reshape(outer.shape[:-2] + (-1,))
@@ -68,34 +82,70 @@ class OuterProductMean(nn.Module):
         # [*, N_res, N_res, C_z]
         outer = self.linear_out(outer)
 
+        # Normalize the (chunk of the) projection while it is still fresh
+        # rather than in a separate pass over the full pair tensor
+        if(inplace_safe):
+            outer /= norm
+        else:
+            outer = outer / norm
+
         return outer
 
     @torch.jit.ignore
     def _chunk(self,
         a: torch.Tensor,
         b: torch.Tensor,
-        chunk_size: int
+        norm: Union[torch.Tensor, float],
+        chunk_size: int,
+        inplace_safe: bool = False,
     ) -> torch.Tensor:
         # Since the "batch dim" in this case is not a true batch dimension
         # (in that the shape of the output depends on it), we need to
         # iterate over it ourselves
         a_reshape = a.reshape((-1,) + a.shape[-3:])
         b_reshape = b.reshape((-1,) + b.shape[-3:])
-        out = []
-        for a_prime, b_prime in zip(a_reshape, b_reshape):
-            outer = chunk_layer(
-                partial(self._opm, b=b_prime),
-                {"a": a_prime},
+        no_batch = a_reshape.shape[0]
+        if(isinstance(norm, torch.Tensor)):
+            # The mask, and with it norm, may have broadcast batch dims
+            norm = norm.expand(a.shape[:-3] + norm.shape[-3:])
+            norm_reshape = norm.reshape((-1,) + norm.shape[-3:])
+        else:
+            norm_reshape = [norm] * no_batch
+
+        def _chunk_opm(a_prime, b_prime, norm_prime):
+            opm = partial(self._opm, b=b_prime, inplace_safe=inplace_safe)
+            inputs = {"a": a_prime}
+            if(isinstance(norm_prime, torch.Tensor)):
+                inputs["norm"] = norm_prime
+            else:
+                opm = partial(opm, norm=norm_prime)
+
+            return chunk_layer(
+                opm,
+                inputs,
                 chunk_size=chunk_size,
                 no_batch_dims=1,
             )
-            out.append(outer)
 
-        # For some cursed reason making this distinction saves memory
-        if(len(out) == 1):
-            outer = out[0].unsqueeze(0)
+        # The common single-batch case needs neither the loop nor the
+        # output buffer
+        if(no_batch == 1):
+            outer = _chunk_opm(
+                a_reshape[0], b_reshape[0], norm_reshape[0]
+            ).unsqueeze(0)
         else:
-            outer = torch.stack(out, dim=0)
+            # The buffer takes the dtype of the normalized chunks, which may
+            # be promoted relative to a by the division
+            outer = None
+            for i, (a_prime, b_prime, norm_prime) in enumerate(
+                zip(a_reshape, b_reshape, norm_reshape)
+            ):
+                outer_prime = _chunk_opm(a_prime, b_prime, norm_prime)
+                if(outer is None):
+                    outer = outer_prime.new_empty(
+                        (no_batch,) + outer_prime.shape
+                    )
+                outer[i] = outer_prime
 
         outer = outer.reshape(a.shape[:-3] + outer.shape[1:])
 
@@ -116,41 +166,52 @@ class OuterProductMean(nn.Module):
         Returns:
             [*, N_res, N_res, C_z] pair embedding update
         """
-        if mask is None:
-            mask = m.new_ones(m.shape[:-1])
+        # Without a mask, masking is a no-op and the normalization reduces to
+        # the number of sequences, so both are skipped
+        mask_is_trivial = mask is None
 
         # [*, N_seq, N_res, C_m]
         ln = self.layer_norm(m)
 
         # [*, N_seq, N_res, C]
-        mask = mask.unsqueeze(-1)
+        if not mask_is_trivial:
+            mask = mask.unsqueeze(-1)
         if faster_alphafold_config.outer_product_mean:
-            a, b = self.linear_12(ln).chunk(2, dim=-1)
+            # Mask both projections with a single kernel, then split
+            ab = self.linear_12(ln)
+            if not mask_is_trivial:
+                if(inplace_safe):
+                    ab *= mask
+                else:
+                    ab = ab * mask
+            a = ab.narrow(-1, 0, self.c_hidden)
+            b = ab.narrow(-1, self.c_hidden, self.c_hidden)
         else:
             a = self.linear_1(ln)
             b = self.linear_2(ln)
-
-        a = a * mask
-        b = b * mask
+            if not mask_is_trivial:
+                a = a * mask
+                b = b * mask
 
         del ln
 
         a = a.transpose(-2, -3)
         b = b.transpose(-2, -3)
 
-        if chunk_size is not None:
-            outer = self._chunk(a, b, chunk_size)
+        if mask_is_trivial:
+            norm = m.shape[-3] + self.eps
         else:
-            outer = self._opm(a, b)
-
-        # [*, N_res, N_res, 1]
-        norm = torch.einsum("...abc,...adc->...bdc", mask, mask)
-        norm = norm + self.eps
+            # [*, N_res, N_res, 1]
+            mask = mask.squeeze(-1)
+            norm = torch.matmul(mask.transpose(-1, -2), mask).unsqueeze(-1)
+            norm = norm + self.eps
 
         # [*, N_res, N_res, C_z]
-        if(inplace_safe):
-            outer /= norm
+        if chunk_size is not None:
+            outer = self._chunk(
+                a, b, norm, chunk_size, inplace_safe=inplace_safe
+            )
         else:
-            outer = outer / norm
+            outer = self._opm(a, b, norm, inplace_safe=inplace_safe)
 
         return outer
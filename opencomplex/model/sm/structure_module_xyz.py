@@ -39,6 +39,94 @@ from opencomplex.utils.tensor_utils import (
     padcat
 )
 
+# Combined protein/RNA residue constants, built once on the CPU at import
+# time and copied to the model device on first use
+_DEFAULT_FRAMES = torch.tensor(
+    padcat([aatype_rigid_group_default_frame[:20], nttype_rigid_group_default_frame])
+)
+_GROUP_IDX = torch.tensor(
+    padcat([aatype_atom14_to_rigid_group[:20], nttype_atom23_to_rigid_group])
+)
+_ATOM_MASK = torch.tensor(
+    padcat([aatype_atom14_mask[:20], nttype_atom23_mask])
+)
+_LIT_POSITIONS = torch.tensor(
+    padcat([aatype_atom14_rigid_group_positions[:20], nttype_atom23_rigid_group_positions])
+)
+
+def _backbone_frame_buffers(xyz, protein_pos, rna_pos):
+    """
+    Builds the per-forward inputs of _backbone_to_global.
+
+    Args:
+        xyz:
+            [*, N_res, 8, 3] backbone atom positions
+        protein_pos:
+            [N_protein] indices of protein residues
+        rna_pos:
+            [N_rna] indices of RNA residues
+    Returns:
+        A [N_res] index gathering the concatenated [protein, RNA] frames
+        back into residue order, and a zero-valued [*, N_protein] Rigid
+        used as the unused second protein frame
+    """
+    no_res = xyz.shape[-3]
+    no_protein = len(protein_pos)
+    if(no_protein + len(rna_pos) != no_res):
+        raise ValueError(
+            f"protein_pos and rna_pos cover {no_protein + len(rna_pos)} "
+            f"residues, expected {no_res}"
+        )
+
+    frame_idx = torch.empty(no_res, dtype=torch.long, device=xyz.device)
+    frame_idx[protein_pos] = torch.arange(no_protein, device=xyz.device)
+    frame_idx[rna_pos] = (
+        torch.arange(len(rna_pos), device=xyz.device) + no_protein
+    )
+
+    dummy_bb = Rigid(
+        Rotation(xyz.new_zeros(xyz.shape[:-3] + (no_protein, 3, 3))),
+        xyz.new_zeros(xyz.shape[:-3] + (no_protein, 3)),
+    )
+
+    return frame_idx, dummy_bb
+
+
+def _backbone_to_global(xyz, protein_pos, rna_pos, frame_idx, dummy_bb):
+    """
+    Constructs the two backbone frames of every residue.
+
+    Args:
+        xyz:
+            [*, N_res, 8, 3] backbone atom positions
+        protein_pos:
+            [N_protein] indices of protein residues
+        rna_pos:
+            [N_rna] indices of RNA residues
+        frame_idx, dummy_bb:
+            Outputs of _backbone_frame_buffers
+    Returns:
+        A [*, N_res, 2] Rigid
+    """
+    bb_protein_to_global = Rigid.from_3_points(
+        xyz[...,protein_pos,0,:], xyz[...,protein_pos,1,:], xyz[...,protein_pos,2,:])
+    bb_protein_to_global = Rigid.stack([bb_protein_to_global, dummy_bb], dim=-1)
+
+    # Both RNA frames share -O4' and are built in a single call:
+    # (-O4', C4', C3') and (-O4', C1', C2')
+    xyz_rna = xyz[..., rna_pos, :, :]
+    p_xy_plane = xyz_rna[..., [5, 7], :]
+    bb_rna_to_global = Rigid.from_3_points(
+        -xyz_rna[..., 3:4, :].expand_as(p_xy_plane),
+        xyz_rna[..., [4, 6], :],
+        p_xy_plane,
+    )
+
+    return Rigid.cat(
+        [bb_protein_to_global, bb_rna_to_global], dim=-2
+    )[..., frame_idx, :]
+
+
 class StructureModuleXYZ(StructureModule):
     def __init__(self, *args, **kwargs):
         super(StructureModuleXYZ, self).__init__(*args, **kwargs)
@@ -92,7 +180,9 @@ class StructureModuleXYZ(StructureModule):
         s = self.linear_in(s)
 
         # black hole initialization
-        xyz = torch.zeros(s.shape[:-1] + (8, 3)).to(s.device)
+        xyz = torch.zeros(s.shape[:-1] + (8, 3), device=s.device)
+
+        frame_idx, dummy_bb = _backbone_frame_buffers(xyz, protein_pos, rna_pos)
 
         outputs = []
         frames = []
@@ -131,28 +221,10 @@ class StructureModuleXYZ(StructureModule):
             unnormalized_angles, angles = self.angle_resnet(s, s_initial)
 
             # all frames
-            bb_protein_to_global = Rigid.from_3_points(
-                xyz[...,protein_pos,0,:], xyz[...,protein_pos,1,:], xyz[...,protein_pos,2,:])
-            dummy_bb = Rigid(
-                Rotation(torch.zeros_like(bb_protein_to_global.get_rots().get_rot_mats())),
-                torch.zeros_like(bb_protein_to_global.get_trans()),
+            bb_to_global = _backbone_to_global(
+                xyz, protein_pos, rna_pos, frame_idx, dummy_bb
             )
 
-            bb_protein_to_global = Rigid.cat([bb_protein_to_global.unsqueeze(-1), dummy_bb.unsqueeze(-1)], dim=-1)
-
-            bb1_to_global = Rigid.from_3_points(
-                -xyz[...,rna_pos,3,:], xyz[...,rna_pos,4,:], xyz[...,rna_pos,5,:])
-            bb2_to_global = Rigid.from_3_points(
-                -xyz[...,rna_pos,3,:], xyz[...,rna_pos,6,:], xyz[...,rna_pos,7,:])
-            bb_rna_to_global = Rigid.cat([bb1_to_global.unsqueeze(-1), bb2_to_global.unsqueeze(-1)], dim=-1)
-
-            bb_to_global = Rigid(
-                rots=Rotation(torch.zeros(s.shape[:-1] + (2, 3, 3), device=s.device)),
-                trans=torch.zeros(s.shape[:-1] + (2, 3), device=s.device))
-
-            bb_to_global[..., protein_pos, :] = bb_protein_to_global
-            bb_to_global[..., rna_pos, :] = bb_rna_to_global
-
             bb_to_global = bb_to_global.scale_translation(self.trans_scale_factor)
             
             all_frames_to_global = self.torsion_angles_to_frames(
@@ -194,34 +266,24 @@ class StructureModuleXYZ(StructureModule):
         return outputs
 
     def _init_residue_constants(self, float_dtype, device):
+        # float_dtype is the dtype of the activations, so under bf16/fp16
+        # the constants are already stored at half precision
+        # copy=True so that instances never share the module-level tensors
         if self.default_frames is None:
-            self.default_frames = torch.tensor(
-                padcat([aatype_rigid_group_default_frame[:20], nttype_rigid_group_default_frame]),
-                dtype=float_dtype,
-                device=device,
-                requires_grad=False,
+            self.default_frames = _DEFAULT_FRAMES.to(
+                device=device, dtype=float_dtype, copy=True
             )
         if self.group_idx is None:
-            self.group_idx = torch.tensor(
-                padcat([aatype_atom14_to_rigid_group[:20], nttype_atom23_to_rigid_group]),
-                device=device,
-                requires_grad=False,
-            )
+            self.group_idx = _GROUP_IDX.to(device=device, copy=True)
         if self.atom_mask is None:
-            self.atom_mask = torch.tensor(
-                padcat([aatype_atom14_mask[:20], nttype_atom23_mask]),
-                dtype=float_dtype,
-                device=device,
-                requires_grad=False,
+            self.atom_mask = _ATOM_MASK.to(
+                device=device, dtype=float_dtype, copy=True
             )
         if self.lit_positions is None:
-            self.lit_positions = torch.tensor(
-                padcat([aatype_atom14_rigid_group_positions[:20], nttype_atom23_rigid_group_positions]),
-                dtype=float_dtype,
-                device=device,
-                requires_grad=False,
+            self.lit_positions = _LIT_POSITIONS.to(
+                device=device, dtype=float_dtype, copy=True
             )
-            
+
     def torsion_angles_to_frames(self, frames, alpha, butype, protein_pos, rna_pos):
         # Lazily initialize the residue constants on the correct device
         self._init_residue_constants(alpha.dtype, alpha.device)
@@ -0,0 +1,323 @@
+# Copyright 2022 BAAI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest import mock
+
+import torch
+
+from opencomplex.faster_alphafold.faster_alphafold_config import faster_alphafold_config
+from opencomplex.loss.loss_utils import (
+    compute_plddt,
+    compute_predicted_aligned_error,
+    compute_tm,
+    lddt,
+    lddt_all,
+    sigmoid_cross_entropy,
+)
+from opencomplex.utils.tensor_utils import permute_final_dims
+from tests.config import consts
+
+
+def _lddt_reference(
+    all_atom_pred_pos,
+    all_atom_positions,
+    all_atom_mask,
+    cutoff=15.0,
+    eps=1e-10,
+    per_residue=True,
+):
+    # Broadcast distances and four separate threshold comparisons
+    n = all_atom_mask.shape[-2]
+    dmat_true = torch.sqrt(
+        eps
+        + torch.sum(
+            (
+                all_atom_positions[..., None, :]
+                - all_atom_positions[..., None, :, :]
+            )
+            ** 2,
+            dim=-1,
+        )
+    )
+    dmat_pred = torch.sqrt(
+        eps
+        + torch.sum(
+            (
+                all_atom_pred_pos[..., None, :]
+                - all_atom_pred_pos[..., None, :, :]
+            )
+            ** 2,
+            dim=-1,
+        )
+    )
+    dists_to_score = (
+        (dmat_true < cutoff)
+        * all_atom_mask
+        * permute_final_dims(all_atom_mask, (1, 0))
+        * (1.0 - torch.eye(n, device=all_atom_mask.device))
+    )
+
+    dist_l1 = torch.abs(dmat_true - dmat_pred)
+
+    score = (
+        (dist_l1 < 0.5).type(dist_l1.dtype)
+        + (dist_l1 < 1.0).type(dist_l1.dtype)
+        + (dist_l1 < 2.0).type(dist_l1.dtype)
+        + (dist_l1 < 4.0).type(dist_l1.dtype)
+    )
+    score = score * 0.25
+
+    dims = (-1,) if per_residue else (-2, -1)
+    norm = 1.0 / (eps + torch.sum(dists_to_score, dim=dims))
+    score = norm * (eps + torch.sum(dists_to_score * score, dim=dims))
+
+    return score
+
+
+def _compute_tm_reference(
+    logits,
+    residue_weights=None,
+    max_bin=31,
+    no_bins=64,
+    eps=1e-8,
+    asym_id=None,
+):
+    # Selects the best alignment with an equality scan and nonzero()
+    if residue_weights is None:
+        residue_weights = logits.new_ones(logits.shape[-2])
+
+    boundaries = torch.linspace(
+        0, max_bin, steps=(no_bins - 1), device=logits.device
+    )
+    step = boundaries[1] - boundaries[0]
+    bin_centers = boundaries + step / 2
+    bin_centers = torch.cat(
+        [bin_centers, (bin_centers[-1] + step).unsqueeze(-1)], dim=0
+    )
+    clipped_n = max(logits.shape[-2], 19)
+    d0 = 1.24 * (clipped_n - 15) ** (1.0 / 3) - 1.8
+
+    probs = torch.nn.functional.softmax(logits, dim=-1)
+    tm_per_bin = 1.0 / (1 + (bin_centers ** 2) / (d0 ** 2))
+    predicted_tm_term = torch.sum(probs * tm_per_bin, dim=-1)
+
+    pair_mask = torch.ones_like(predicted_tm_term)
+    if asym_id is not None:
+        pair_mask *= asym_id[..., None] != asym_id[..., None, :]
+
+    predicted_tm_term *= pair_mask
+
+    pair_residue_weights = pair_mask * (
+        residue_weights[None, :] * residue_weights[:, None])
+    normed_residue_mask = pair_residue_weights / (eps + pair_residue_weights.sum())
+    per_alignment = torch.sum(predicted_tm_term * normed_residue_mask, dim=-1)
+
+    weighted = per_alignment * residue_weights
+
+    argmax = (weighted == torch.max(weighted)).nonzero()[0]
+    return per_alignment[tuple(argmax)]
+
+
+def _run_confidence_metrics(plddt_logits, pae_logits):
+    return (
+        compute_plddt(plddt_logits),
+        compute_predicted_aligned_error(pae_logits)["predicted_aligned_error"],
+        compute_tm(pae_logits),
+    )
+
+
+class TestConfidenceMetricCompile(unittest.TestCase):
+    def setUp(self):
+        self.plddt_logits = torch.rand((consts.n_res, 50))
+        self.pae_logits = torch.rand((consts.n_res, consts.n_res, 64))
+
+    def test_compile_off_by_default(self):
+        self.assertFalse(faster_alphafold_config.compile_confidence_metrics)
+
+        with mock.patch.object(torch, "compile", create=True) as compile_fn:
+            _run_confidence_metrics(self.plddt_logits, self.pae_logits)
+
+        compile_fn.assert_not_called()
+
+    @unittest.skipUnless(
+        hasattr(torch, "compile"), "torch.compile requires PyTorch >= 2.0"
+    )
+    def test_compile_matches_eager(self):
+        out_eager = _run_confidence_metrics(
+            self.plddt_logits, self.pae_logits
+        )
+
+        faster_alphafold_config.compile_confidence_metrics = True
+        try:
+            out_compiled = _run_confidence_metrics(
+                self.plddt_logits, self.pae_logits
+            )
+        finally:
+            faster_alphafold_config.compile_confidence_metrics = False
+
+        for eager, compiled in zip(out_eager, out_compiled):
+            self.assertTrue(torch.max(torch.abs(eager - compiled)) < consts.eps)
+
+
+class TestSigmoidCrossEntropy(unittest.TestCase):
+    def test_sigmoid_cross_entropy(self):
+        logits = (torch.rand((consts.n_res, 37)) - 0.5) * 40
+        labels = torch.randint(0, 2, (consts.n_res, 37)).float()
+
+        # fp64 logsigmoid reference
+        logits_64 = logits.double()
+        labels_64 = labels.double()
+        out_gt = (
+            (-1. * labels_64) * torch.nn.functional.logsigmoid(logits_64)
+            - (1. - labels_64) * torch.nn.functional.logsigmoid(-logits_64)
+        )
+        out_repro = sigmoid_cross_entropy(logits, labels)
+
+        self.assertTrue(out_repro.dtype == logits.dtype)
+        self.assertTrue(
+            torch.max(torch.abs(out_gt - out_repro.double())) < 1e-5
+        )
+
+    def test_sigmoid_cross_entropy_bf16(self):
+        logits = ((torch.rand((consts.n_res, 37)) - 0.5) * 40).bfloat16()
+        labels = torch.randint(0, 2, (consts.n_res, 37)).bfloat16()
+
+        out_gt = sigmoid_cross_entropy(logits.float(), labels.float())
+        out_repro = sigmoid_cross_entropy(logits, labels)
+
+        self.assertTrue(out_repro.dtype == torch.bfloat16)
+        self.assertTrue(
+            torch.max(torch.abs(out_gt - out_repro.float()) / (1 + out_gt))
+            < 1e-2
+        )
+
+
+class TestComputeTM(unittest.TestCase):
+    def _compare(self, logits, **kwargs):
+        out_gt = _compute_tm_reference(logits, **kwargs)
+        out_repro = compute_tm(logits, **kwargs)
+
+        self.assertTrue(out_repro.shape == out_gt.shape)
+        self.assertTrue(torch.abs(out_gt - out_repro) < 1e-6)
+
+    def test_compute_tm(self):
+        n_res = consts.n_res
+
+        logits = torch.rand((n_res, n_res, 64)) * 10
+        residue_weights = torch.rand((n_res,))
+        asym_id = torch.randint(0, 2, (n_res,))
+
+        self._compare(logits)
+        self._compare(logits, residue_weights=residue_weights)
+        self._compare(logits, asym_id=asym_id)
+
+    def test_compute_tm_batched(self):
+        logits = torch.rand((consts.batch_size, consts.n_res, consts.n_res, 64))
+
+        self._compare(logits)
+
+    def test_compute_tm_ties(self):
+        # Identical rows make every alignment tie for the maximum; both
+        # implementations must pick the first one
+        logits = torch.rand((64,)).expand(consts.n_res, consts.n_res, 64)
+        logits = logits.contiguous()
+
+        self._compare(logits)
+
+
+class TestLDDT(unittest.TestCase):
+    def test_lddt_exact_thresholds(self):
+        # Neighbouring residues are 10A apart in the ground truth, so only
+        # they are within the cutoff. The predicted neighbour distances are
+        # off by exactly 0.5, 1, 2, 4, 0 and 0A. The last residue is masked
+        true_x = torch.tensor([0.0, 10.0, 20.0, 30.0, 40.0, 50.0, 60.0])
+        pred_x = torch.tensor([0.0, 10.5, 21.5, 33.5, 47.5, 57.5, 67.5])
+        all_atom_positions = torch.zeros((7, 3))
+        all_atom_positions[:, 0] = true_x
+        all_atom_pred_pos = torch.zeros((7, 3))
+        all_atom_pred_pos[:, 0] = pred_x
+        all_atom_mask = torch.ones((7, 1))
+        all_atom_mask[-1] = 0
+
+        for per_residue in [True, False]:
+            out_gt = _lddt_reference(
+                all_atom_pred_pos,
+                all_atom_positions,
+                all_atom_mask,
+                per_residue=per_residue,
+            )
+            out_repro = lddt(
+                all_atom_pred_pos,
+                all_atom_positions,
+                all_atom_mask,
+                per_residue=per_residue,
+            )
+
+            self.assertTrue(torch.max(torch.abs(out_gt - out_repro)) < 1e-6)
+
+        # Residue 0 only sees residue 1, with an error of exactly 0.5A, which
+        # is below three of the four thresholds
+        out_repro = lddt(all_atom_pred_pos, all_atom_positions, all_atom_mask)
+        self.assertTrue(abs(out_repro[0].item() - 0.75) < 1e-6)
+
+    def test_lddt_random(self):
+        batch_size = consts.batch_size
+        n_res = consts.n_res
+
+        all_atom_positions = torch.rand((batch_size, n_res, 3)) * 20
+        all_atom_pred_pos = (
+            all_atom_positions + torch.randn((batch_size, n_res, 3)) * 2
+        )
+        all_atom_mask = torch.randint(0, 2, (batch_size, n_res, 1)).float()
+        all_atom_mask[:, 0] = 0
+
+        out_gt = _lddt_reference(
+            all_atom_pred_pos, all_atom_positions, all_atom_mask
+        )
+        out_repro = lddt(all_atom_pred_pos, all_atom_positions, all_atom_mask)
+
+        self.assertTrue(torch.max(torch.abs(out_gt - out_repro)) < consts.eps)
+
+    def test_lddt_all(self):
+        n_res = consts.n_res
+        n_atom = 5
+
+        all_atom_positions = torch.rand((n_res, n_atom, 3)) * 20
+        all_atom_pred_pos = (
+            all_atom_positions + torch.randn((n_res, n_atom, 3)) * 2
+        )
+        all_atom_mask = torch.randint(0, 2, (n_res, n_atom)).float()
+        all_atom_mask[0] = 0
+
+        out_gt = _lddt_reference(
+            all_atom_pred_pos.reshape(-1, 3),
+            all_atom_positions.reshape(-1, 3),
+            all_atom_mask.reshape(-1, 1),
+            eps=1e-8,
+            per_residue=False,
+        )
+        out_repro = lddt_all(
+            all_atom_pred_pos,
+            all_atom_positions,
+            all_atom_mask,
+            eps=1e-8,
+            per_residue=False,
+        )
+
+        self.assertTrue(torch.max(torch.abs(out_gt - out_repro)) < consts.eps)
+
+
+if __name__ == "__main__":
+    unittest.main()
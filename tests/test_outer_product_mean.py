@@ -45,6 +45,48 @@ class TestOuterProductMean(unittest.TestCase):
             (consts.batch_size, consts.n_res, consts.n_res, consts.c_z)
         )
 
+    def test_no_mask_matches_ones_mask(self):
+        c = 31
+
+        opm = OuterProductMean(consts.c_m, consts.c_z, c)
+        # linear_out is zero-initialized
+        torch.nn.init.normal_(opm.linear_out.weight)
+
+        m = torch.rand(
+            (consts.batch_size, consts.n_seq, consts.n_res, consts.c_m)
+        )
+        mask = torch.ones((consts.batch_size, consts.n_seq, consts.n_res))
+
+        with torch.no_grad():
+            out_masked = opm(m, mask=mask, chunk_size=None)
+            out_unmasked = opm(m, mask=None, chunk_size=None)
+
+        self.assertTrue(
+            torch.max(torch.abs(out_masked - out_unmasked)) < consts.eps
+        )
+
+    def test_chunk_broadcast_mask(self):
+        c = 31
+
+        opm = OuterProductMean(consts.c_m, consts.c_z, c)
+        # linear_out is zero-initialized
+        torch.nn.init.normal_(opm.linear_out.weight)
+
+        m = torch.rand(
+            (consts.batch_size, consts.n_seq, consts.n_res, consts.c_m)
+        )
+        mask = torch.randint(
+            0, 2, size=(1, consts.n_seq, consts.n_res)
+        ).float()
+
+        with torch.no_grad():
+            out_chunked = opm(m, mask=mask, chunk_size=4)
+            out_unchunked = opm(m, mask=mask, chunk_size=None)
+
+        self.assertTrue(
+            torch.max(torch.abs(out_chunked - out_unchunked)) < consts.eps
+        )
+
     @compare_utils.skip_unless_alphafold_installed()
     def test_opm_compare(self):
         def run_opm(msa_act, msa_mask):
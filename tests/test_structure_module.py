@@ -31,6 +31,10 @@ from opencomplex.model.sm.structure_module import (
     AngleResnet,
     InvariantPointAttention,
 )
+from opencomplex.model.sm.structure_module_xyz import (
+    _backbone_frame_buffers,
+    _backbone_to_global,
+)
 import opencomplex.utils.feats as feats
 from opencomplex.utils.rigid_utils import Rotation, Rigid
 import tests.compare_utils as compare_utils
@@ -284,5 +288,89 @@ class TestAngleResnet(unittest.TestCase):
         self.assertTrue(a.shape == (batch_size, n, no_angles, 2))
 
 
+def _backbone_to_global_reference(xyz, protein_pos, rna_pos):
+    # Scatter-into-zeros construction the gather in StructureModuleXYZ
+    # replaced
+    bb_protein_to_global = Rigid.from_3_points(
+        xyz[..., protein_pos, 0, :],
+        xyz[..., protein_pos, 1, :],
+        xyz[..., protein_pos, 2, :],
+    )
+    dummy_bb = Rigid(
+        Rotation(torch.zeros_like(bb_protein_to_global.get_rots().get_rot_mats())),
+        torch.zeros_like(bb_protein_to_global.get_trans()),
+    )
+    bb_protein_to_global = Rigid.cat(
+        [bb_protein_to_global.unsqueeze(-1), dummy_bb.unsqueeze(-1)], dim=-1
+    )
+
+    bb1_to_global = Rigid.from_3_points(
+        -xyz[..., rna_pos, 3, :], xyz[..., rna_pos, 4, :], xyz[..., rna_pos, 5, :]
+    )
+    bb2_to_global = Rigid.from_3_points(
+        -xyz[..., rna_pos, 3, :], xyz[..., rna_pos, 6, :], xyz[..., rna_pos, 7, :]
+    )
+    bb_rna_to_global = Rigid.cat(
+        [bb1_to_global.unsqueeze(-1), bb2_to_global.unsqueeze(-1)], dim=-1
+    )
+
+    bb_to_global = Rigid(
+        rots=Rotation(torch.zeros(xyz.shape[:-2] + (2, 3, 3))),
+        trans=torch.zeros(xyz.shape[:-2] + (2, 3)),
+    )
+    bb_to_global[..., protein_pos, :] = bb_protein_to_global
+    bb_to_global[..., rna_pos, :] = bb_rna_to_global
+
+    return bb_to_global
+
+
+class TestStructureModuleXYZ(unittest.TestCase):
+    def _compare_backbone_to_global(self, protein_pos, rna_pos):
+        batch_size = consts.batch_size
+        n = consts.n_res
+
+        xyz = torch.rand((batch_size, n, 8, 3)) * 10
+
+        frame_idx, dummy_bb = _backbone_frame_buffers(xyz, protein_pos, rna_pos)
+        out_repro = _backbone_to_global(
+            xyz, protein_pos, rna_pos, frame_idx, dummy_bb
+        )
+        out_gt = _backbone_to_global_reference(xyz, protein_pos, rna_pos)
+
+        self.assertTrue(out_repro.shape == (batch_size, n, 2))
+        self.assertTrue(
+            torch.max(torch.abs(
+                out_gt.get_rots().get_rot_mats()
+                - out_repro.get_rots().get_rot_mats()
+            )) < consts.eps
+        )
+        self.assertTrue(
+            torch.max(torch.abs(out_gt.get_trans() - out_repro.get_trans()))
+            < consts.eps
+        )
+
+    def test_backbone_to_global_complex(self):
+        bio_id = torch.randint(0, 2, (consts.n_res,))
+        bio_id[0] = 0
+        bio_id[1] = 1
+        protein_pos = torch.where(bio_id == 0)[-1]
+        rna_pos = torch.where(bio_id == 1)[-1]
+
+        self._compare_backbone_to_global(protein_pos, rna_pos)
+
+    def test_backbone_to_global_rna(self):
+        self._compare_backbone_to_global([], torch.arange(consts.n_res))
+
+    def test_backbone_to_global_protein(self):
+        self._compare_backbone_to_global(torch.arange(consts.n_res), [])
+
+    def test_backbone_frame_buffers_coverage(self):
+        xyz = torch.rand((consts.n_res, 8, 3))
+        protein_pos = torch.arange(consts.n_res - 1)
+
+        with self.assertRaises(ValueError):
+            _backbone_frame_buffers(xyz, protein_pos, [])
+
+
 if __name__ == "__main__":
     unittest.main()